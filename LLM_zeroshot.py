@@ -1,48 +1,164 @@
 import json
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+import os
+import time
+import torch
+from transformers import T5TokenizerFast, T5ForConditionalGeneration
 from tqdm import tqdm
 
 MODEL_PATH = "./t5_finetuned_api"
 TEST_FILE = "./api_dataset/test.json"
-OUTPUT_FILE = "./predictions_zero_shot.json"
+OUTPUT_FILE = "./predictions_zero_shot.jsonl"
+MAX_INPUT_LENGTH = 512
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 16))
+NUM_BEAMS = int(os.getenv("NUM_BEAMS", 1))  # 1 = greedy decoding
+MAX_OUTPUT_LENGTH = 80
 
-tokenizer = T5Tokenizer.from_pretrained(MODEL_PATH)
-model = T5ForConditionalGeneration.from_pretrained(MODEL_PATH)
+# Saved with each record; resumed runs only reuse matching predictions
+GENERATION_CONFIG = {"max_length": MAX_OUTPUT_LENGTH, "num_beams": NUM_BEAMS}
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+torch.set_grad_enabled(False)  # inference only
+if DEVICE == "cuda":
+    # Native bf16 needs Ampere+ (sm_80); older cards such as the T4 only
+    # emulate it, which is slower than fp16
+    DTYPE = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+else:
+    DTYPE = torch.float32
+
+tokenizer = T5TokenizerFast.from_pretrained(MODEL_PATH)
+try:
+    model = T5ForConditionalGeneration.from_pretrained(
+        MODEL_PATH, torch_dtype=DTYPE, attn_implementation="sdpa"
+    )
+except ValueError:  # T5 has no SDPA path in this transformers version
+    model = T5ForConditionalGeneration.from_pretrained(
+        MODEL_PATH, torch_dtype=DTYPE, attn_implementation="eager"
+    )
+model = model.to(DEVICE)
 model.eval()
 
-def generate(prompt, max_length=80):
-    inputs = tokenizer(prompt, return_tensors="pt")
+# Default mode: shapes vary per batch and per decode step, which defeats
+# the CUDA graphs that "reduce-overhead" relies on
+if DEVICE == "cuda":
+    model.forward = torch.compile(model.forward, fullgraph=False)
+
+def build_prompt(input_text):
+    # ZERO-SHOT PROMPT
+    return (
+        "document:\n"
+        "You are an API documentation expert.\n"
+        "Generate a concise, human-readable description.\n\n"
+        f"{input_text}"
+    )
+
+def to_device(inputs):
+    # Pinned host memory lets the host-to-device copy run asynchronously
+    if DEVICE != "cuda":
+        return dict(inputs)
+    return {k: v.pin_memory().to(DEVICE, non_blocking=True) for k, v in inputs.items()}
+
+@torch.inference_mode()
+def generate(prompt_ids, max_length=MAX_OUTPUT_LENGTH):
+    # prompt_ids are pre-tokenized; only padding happens per batch
+    inputs = to_device(tokenizer.pad(
+        {"input_ids": prompt_ids},
+        return_tensors="pt"
+    ))
     outputs = model.generate(
         **inputs,
         max_length=max_length,
-        num_beams=4,
-        early_stopping=True
+        num_beams=NUM_BEAMS,
+        do_sample=False,
+        early_stopping=NUM_BEAMS > 1
     )
-    return tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-predictions = []
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
 
 with open(TEST_FILE, encoding="utf-8", errors="replace") as f:
-    for line in tqdm(f):
-        item = json.loads(line)
+    items = [json.loads(line) for line in f]
+
+# Tokenize every prompt once; the ids drive both the sort and the batches
+prompt_ids = tokenizer(
+    [build_prompt(item["input_text"]) for item in items],
+    truncation=True,
+    max_length=MAX_INPUT_LENGTH
+).input_ids
+
+# Sort by token length so each batch pads to a similar length
+order = sorted(range(len(items)), key=lambda j: len(prompt_ids[j]))
+
+def load_finished(path):
+    # Reusable records (same test set and config) plus a count of stale ones
+    # from a different test set or config; unparseable lines are skipped
+    finished = {}
+    stale = 0
+    if not os.path.exists(path):
+        return finished, stale
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                j = record["index"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue  # e.g. a line truncated by a crash mid-write
+
+            if (
+                isinstance(j, int)
+                and 0 <= j < len(items)
+                and record.get("input") == items[j]["input_text"]
+                and record.get("config") == GENERATION_CONFIG
+            ):
+                finished[j] = record
+            else:
+                stale += 1
+    return finished, stale
+
+def write_sorted(path, records):
+    # Atomic rewrite in test-file order
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for j in sorted(records):
+            f.write(json.dumps(records[j], ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+# Resume from an interrupted run; rewriting drops truncated lines. A file
+# holding another test set's or config's predictions is moved aside, not lost.
+finished, stale = load_finished(OUTPUT_FILE)
+if stale:
+    root, ext = os.path.splitext(OUTPUT_FILE)
+    backup = f"{root}.{int(time.time())}{ext}"
+    os.replace(OUTPUT_FILE, backup)
+    print(f"⚠️  {stale} predictions from a different test set or config moved to {backup}")
+if os.path.exists(OUTPUT_FILE) or finished:
+    print(f"Resuming with {len(finished)} existing predictions")
+    write_sorted(OUTPUT_FILE, finished)
+remaining = [j for j in order if j not in finished]
+
+if not remaining:
+    print(f"All {len(items)} predictions already present in {OUTPUT_FILE}")
+
+# Warm-up absorbs the one-off compile time
+if DEVICE == "cuda" and remaining:
+    generate([prompt_ids[j] for j in remaining[:BATCH_SIZE]])
 
-        # ZERO-SHOT PROMPT
-        prompt = (
-            "document:\n"
-            "You are an API documentation expert.\n"
-            "Generate a concise, human-readable description.\n\n"
-            f"{item['input_text']}"
-        )
+# Batches run in length order; the file is re-sorted by index at the end
+with open(OUTPUT_FILE, "a", encoding="utf-8") as out_f:
+    for i in tqdm(range(0, len(remaining), BATCH_SIZE)):
+        batch_idx = remaining[i:i + BATCH_SIZE]
 
-        output = generate(prompt)
+        outputs = generate([prompt_ids[j] for j in batch_idx])
 
-        predictions.append({
-            "input": item["input_text"],
-            "reference": item["target_text"],
-            "prediction": output
-        })
+        for j, output in zip(batch_idx, outputs):
+            record = {
+                "index": j,
+                "input": items[j]["input_text"],
+                "reference": items[j]["target_text"],
+                "prediction": output,
+                "config": GENERATION_CONFIG
+            }
+            out_f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out_f.flush()
 
-with open(OUTPUT_FILE, "w") as f:
-    json.dump(predictions, f, indent=2)
+write_sorted(OUTPUT_FILE, load_finished(OUTPUT_FILE)[0])
 
-print("✅ Inference complete. Saved to", OUTPUT_FILE)
\ No newline at end of file
+print("✅ Inference complete. Saved to", OUTPUT_FILE)
@@ -1,25 +1,38 @@
 import os
+import gc
 import yaml
+from multiprocessing import Pool
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml-backed, much faster
+except ImportError:
+    from yaml import SafeLoader
 import json
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+try:
+    import orjson  # optional: several times faster than json/pandas writers
+except ImportError:
+    orjson = None
 import re
 
 # Configuration
 ROOT_DIR = "open_api_specs"  # Make sure this matches your actual folder name
 TARGET_FOLDERS = ["broken", "business", "deployed", "public", "specs-3.0"]
 
+# Path-item keys that are not HTTP methods
+_NON_METHOD_KEYS = frozenset({'summary', 'description', 'parameters', 'servers', '$ref'})
+
+# Precompiled once; \s already covers \n, \r and non-breaking spaces
+_TAG_RE = re.compile(r'<[^>]+>')
+_WS_RE = re.compile(r'\s+')
+
 def clean_text(text):
     """Clean text for training."""
     if not text:
         return ""
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', str(text))
-    # Replace newlines with spaces
-    text = text.replace('\n', ' ').replace('\r', ' ')
-    # Remove multiple spaces
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    # Remove HTML tags, then collapse all whitespace (incl. newlines)
+    text = _TAG_RE.sub('', str(text))
+    return _WS_RE.sub(' ', text).strip()
 
 def is_dict(obj):
     """Safe check if object is dictionary."""
@@ -36,8 +49,13 @@ def parse_yaml_file(filepath, filename):
     dataset = []
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        # Only 'paths' entries are extracted, so skip the YAML parse entirely
+        # for files that cannot contain that key (in any quoting style)
+        if b'paths' not in raw:
+            return []
+        data = yaml.load(raw, Loader=SafeLoader)
     except Exception as e:
         print(f"⚠️  Skipping malformed file {filename}: {e}")
         return []
@@ -54,7 +72,7 @@ def parse_yaml_file(filepath, filename):
                 
             for method_key, method_content in path_content.items():
                 # Skip non-method keys
-                if method_key in ['summary', 'description', 'parameters', 'servers', '$ref']:
+                if method_key in _NON_METHOD_KEYS:
                     continue
                     
                 # Only process if method_content is a dict
@@ -62,9 +80,9 @@ def parse_yaml_file(filepath, filename):
                     continue
                 
                 # Extract operation data SAFELY
-                description = safe_get(method_content, 'description')
-                summary = safe_get(method_content, 'summary', '')
-                tags = safe_get(method_content, 'tags', [])
+                description = method_content.get('description')
+                summary = method_content.get('summary', '')
+                tags = method_content.get('tags', [])
                 
                 # Construct Input Context
                 # We format tags nicely if they exist
@@ -84,10 +102,43 @@ def parse_yaml_file(filepath, filename):
 
     return dataset
 
+def write_jsonl(df, filepath):
+    """Write a DataFrame as JSON Lines (one record per line)."""
+    records = df.to_dict(orient="records")
+    if orjson is not None:
+        with open(filepath, "wb") as f:
+            f.writelines(orjson.dumps(r) + b"\n" for r in records)
+    else:
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+# Workers run with the cyclic GC disabled; collect every N files so any
+# reference cycles left by parsing cannot accumulate over the whole corpus
+GC_EVERY_N_FILES = 50
+_files_parsed = 0
+
+def parse_file_task(filepath, filename):
+    """Pool worker: never raises, so one bad file cannot kill the pool."""
+    global _files_parsed
+    _files_parsed += 1
+    if _files_parsed % GC_EVERY_N_FILES == 0:
+        gc.collect()
+
+    try:
+        return parse_yaml_file(filepath, filename), None
+    except Exception as e:
+        return [], str(e)
+
+def parse_file_task_star(task):
+    """Single-argument wrapper so the task list can be fed to Pool.imap."""
+    return parse_file_task(*task)
+
 def main():
     print("🚀 Starting Focused Data Extraction (Operations Only)...")
     all_data = []
+    seen_inputs = set()
     skipped_files = 0
+    tasks = []
     
     for folder in TARGET_FOLDERS:
         folder_path = os.path.join(ROOT_DIR, folder)
@@ -95,18 +146,39 @@ def main():
             print(f"⚠️  Folder not found: {folder_path}")
             continue
             
-        print(f"📂 Processing folder: {folder}...")
+        print(f"📂 Collecting files in folder: {folder}...")
         
         for root, _, files in os.walk(folder_path):
             for file in files:
                 if file.endswith(('.yaml', '.yml', '.json')):
-                    full_path = os.path.join(root, file)
-                    try:
-                        extracted = parse_yaml_file(full_path, file)
-                        all_data.extend(extracted)
-                    except Exception as e:
-                        skipped_files += 1
-                        print(f"⚠️  Error processing {file}: {str(e)[:50]}...")
+                    tasks.append((os.path.join(root, file), file))
+
+    # YAML parsing is CPU-bound, so spread files across all cores.
+    # chunksize=1 balances load: a single large spec can take seconds.
+    print(f"⚙️  Parsing {len(tasks)} files on {os.cpu_count()} processes...")
+    # Parsing and merging allocate millions of small, acyclic objects;
+    # pausing the cyclic GC (here and in the workers) avoids repeated scans.
+    gc.disable()
+    try:
+        with Pool(os.cpu_count(), initializer=gc.disable) as pool:
+            # imap yields each file's result as soon as it (and every file
+            # before it) is parsed, in task order, so duplicates are dropped
+            # immediately and first occurrence still wins
+            results = pool.imap(parse_file_task_star, tasks, chunksize=1)
+            for (_, file), (extracted, error) in zip(tasks, results):
+                if error is not None:
+                    skipped_files += 1
+                    print(f"⚠️  Error processing {file}: {error[:50]}...")
+                    continue
+                for record in extracted:
+                    if record["input_text"] in seen_inputs:
+                        continue
+                    seen_inputs.add(record["input_text"])
+                    all_data.append(record)
+        del seen_inputs
+    finally:
+        gc.collect()
+        gc.enable()
 
     print(f"\n📊 RESULTS:")
     print(f"✅ Successfully processed files: {len(all_data) > 0}")
@@ -116,23 +188,29 @@ def main():
         print("❌ No valid data extracted! Check your ROOT_DIR path.")
         return
     
-    # Create DataFrame
-    df = pd.DataFrame(all_data)
-    
-    # Remove duplicates
-    df.drop_duplicates(subset=['input_text'], inplace=True)
+    # Create DataFrame (already deduplicated on input_text)
+    df = pd.DataFrame.from_records(all_data)
+    # Low-cardinality string columns are far smaller as categoricals
+    df['type'] = df['type'].astype('category')
+    df['source_file'] = df['source_file'].astype('category')
     
     print(f"✅ Extracted {len(df)} unique operation descriptions!")
     
     # Save splits (80/10/10)
     print("✂️ Splitting data...")
-    train, temp = train_test_split(df, test_size=0.2, random_state=42)
-    val, test = train_test_split(temp, test_size=0.5, random_state=42)
+    # One seeded permutation, sliced into the three splits
+    rng = np.random.default_rng(42)
+    idx = rng.permutation(len(df))
+    n_train = int(len(df) * 0.8)
+    n_val = int(len(df) * 0.1)
+    train = df.iloc[idx[:n_train]]
+    val = df.iloc[idx[n_train:n_train + n_val]]
+    test = df.iloc[idx[n_train + n_val:]]
     
     # Save to JSON
-    train.to_json("train.json", orient="records", lines=True, force_ascii=False)
-    val.to_json("val.json", orient="records", lines=True, force_ascii=False)
-    test.to_json("test.json", orient="records", lines=True, force_ascii=False)
+    write_jsonl(train, "train.json")
+    write_jsonl(val, "val.json")
+    write_jsonl(test, "test.json")
     
     print(f"\n🎉 SUCCESS! Dataset ready for Training:")
     print(f"   📄 train.json: {len(train)} examples")